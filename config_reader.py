@@ -46,6 +46,24 @@ class ConfigReader:
         channel_ids = self.get_list('THINGSPEAK', 'channel_ids')
         return read_api_keys, us_write_api_keys, as_write_api_key, channel_ids
 
+    def get_pipeline_info(self):
+        """
+        Returns the schedule of the StockAnalyser pipeline and the address its results are published on.
+        """
+        def get_float(key, default):
+            value = self.get_param('PIPELINE', key)
+            return float(value) if value else default
+
+        return {
+            "interval": get_float('interval', 15.0),
+            "fetch_timeout": get_float('fetch_timeout', 10.0),
+            "update_timeout": get_float('update_timeout', 10.0),
+            "plot_timeout": get_float('plot_timeout', 10.0),
+            "snapshot_host": self.get_param('PIPELINE', 'snapshot_host') or "127.0.0.1",
+            "snapshot_port": int(self.get_param('PIPELINE', 'snapshot_port') or 5001),
+            "snapshot_max_age": get_float('snapshot_max_age', 60.0),
+        }
+
     def print_params(self):
         """
         Prints out all configuration parameters in a formatted way.
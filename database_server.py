@@ -1,9 +1,16 @@
 from flask import Flask, request, jsonify, send_file
+from functools import wraps
+import argparse
+import binascii
+import io
 import json
 import os
 import time
 import rsa
 import base64
+from config_reader import ConfigReader
+from rate_limiter import RateLimiter
+from snapshot import SnapshotStore, SnapshotClient
 
 app = Flask(__name__)
 
@@ -112,6 +119,98 @@ def get_public_key():
     return jsonify({"public_key": public_key.save_pkcs1().decode()})
 
 
+# Admission control for the endpoints that perform RSA decryption.
+# Every request costs a token from the bucket of the client IP before any RSA work is done,
+# and once the payload has been decrypted, a token from the bucket of the (username, client IP) pair
+# and one from the bucket of the username alone. The per-username budget refills faster than a single
+# client may spend it, so one client can not lock a user out, while the total rate of attempts
+# on one account stays capped however many IPs they come from.
+IP_BUCKET_CAPACITY = 10         # Burst size per client IP
+IP_REFILL_RATE = 1              # Sustained requests per second per client IP
+USER_IP_BUCKET_CAPACITY = 5     # Burst size per username and client IP
+USER_IP_REFILL_RATE = 0.2       # Sustained requests per second per username and client IP
+USER_BUCKET_CAPACITY = 30       # Burst size per username, across all client IPs
+USER_REFILL_RATE = 1            # Sustained requests per second per username, across all client IPs
+RATE_LIMIT_MAX_ENTRIES = 10000  # Maximum number of IPs/usernames tracked at once (LRU evicted)
+MAX_REQUEST_BYTES = 4096        # Largest request body accepted on the encrypted endpoints
+
+ip_limiter = RateLimiter(IP_BUCKET_CAPACITY, IP_REFILL_RATE, RATE_LIMIT_MAX_ENTRIES)
+user_ip_limiter = RateLimiter(USER_IP_BUCKET_CAPACITY, USER_IP_REFILL_RATE, RATE_LIMIT_MAX_ENTRIES)
+user_limiter = RateLimiter(USER_BUCKET_CAPACITY, USER_REFILL_RATE, RATE_LIMIT_MAX_ENTRIES)
+
+
+def too_many_requests(retry_after):
+    """
+    Build the 429 response returned to clients that are over budget.
+    """
+    response = jsonify({"error": "Too many requests, please retry later"})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def check_encrypted_payload(data):
+    """
+    Cheap structural check of an encrypted request, done before any RSA work.
+    Returns an error message if the payload can not possibly decrypt, otherwise None.
+    """
+    if not isinstance(data, dict):
+        return "Request body must be a JSON object"
+    encrypted_message = data.get('encrypted_message')
+    if not encrypted_message or not isinstance(encrypted_message, str):
+        return "No encrypted_message found in the request"
+    # A valid ciphertext is exactly one RSA block long
+    block_size = rsa.common.byte_size(private_key.n)
+    if len(encrypted_message) != 4 * ((block_size + 2) // 3):
+        return "Malformed encrypted_message"
+    try:
+        encrypted_message_bytes = base64.b64decode(encrypted_message, validate=True)
+    except (binascii.Error, ValueError):
+        return "Malformed encrypted_message"
+    if len(encrypted_message_bytes) != block_size:
+        return "Malformed encrypted_message"
+    return None
+
+
+def admission_control(route):
+    """
+    Decorator for routes that decrypt the request body. Rejects over-budget clients with a 429,
+    bodies without a Content-Length (411) and oversized (413) or malformed (400) payloads
+    before decrypt_json is reached.
+    """
+    @wraps(route)
+    def wrapper(*args, **kwargs):
+        if request.method == 'POST':
+            allowed, retry_after = ip_limiter.consume(request.remote_addr or "unknown")
+            if not allowed:
+                return too_many_requests(retry_after)
+            if request.content_length is None:
+                return jsonify({"error": "Content-Length is required"}), 411
+            if request.content_length > MAX_REQUEST_BYTES:
+                return jsonify({"error": "Request body too large"}), 413
+            error = check_encrypted_payload(request.get_json(silent=True))
+            if error:
+                return jsonify({"error": error}), 400
+        return route(*args, **kwargs)
+    return wrapper
+
+
+def check_user_rate(username):
+    """
+    Charge a request to the bucket of `username` for the requesting client IP, then to the bucket
+    of `username` across all clients.
+    Returns a 429 response if the user is over either budget, otherwise None.
+    """
+    username = str(username)
+    allowed, retry_after = user_ip_limiter.consume((username, request.remote_addr or "unknown"))
+    if not allowed:
+        return too_many_requests(retry_after)
+    allowed, retry_after = user_limiter.consume(username)
+    if not allowed:
+        return too_many_requests(retry_after)
+    return None
+
+
 def decrypt_json(data):
     print("----------Decrypting Incoming Message----------")
     global private_key
@@ -139,6 +238,7 @@ def decrypt_json(data):
 
 
 @app.route('/register', methods=['POST'])
+@admission_control
 def register():
     data = decrypt_json(request.json)
     username = data.get('username')
@@ -151,6 +251,10 @@ def register():
     if not all([username, password, auth_method, telephone_number]):
         return jsonify({"error": "All fields (username, password, auth_method, telephone_number) are required"}), 400
 
+    limited = check_user_rate(username)
+    if limited:
+        return limited
+
     success, message = UserDatabase.add_user(username, password, auth_method, telephone_number)
     if success:
         return jsonify({"message": message}), 201
@@ -159,6 +263,7 @@ def register():
 
 
 @app.route('/login', methods=['POST'])
+@admission_control
 def login():
     try:
         data = decrypt_json(request.json)
@@ -169,6 +274,10 @@ def login():
         if not username or not password:
             return jsonify({"error": "Username and password are required"}), 400
 
+        limited = check_user_rate(username)
+        if limited:
+            return limited
+
         if UserAuthenticator.check(username, password):
             return jsonify({"message": "Login successful"}), 200
         else:
@@ -179,6 +288,7 @@ def login():
 
 
 @app.route('/get_chat_id', methods=['POST'])
+@admission_control
 def get_chat_id():
     try:
         data = decrypt_json(request.json)
@@ -189,6 +299,10 @@ def get_chat_id():
         if not username or not password:
             return jsonify({"error": "Username and password are required"}), 400
 
+        limited = check_user_rate(username)
+        if limited:
+            return limited
+
         if UserAuthenticator.check(username, password):
             user_data = UserDatabase.get_user(username)
             if user_data['chat_id']:
@@ -203,6 +317,7 @@ def get_chat_id():
 
 
 @app.route('/add_chat_id', methods=['POST'])
+@admission_control
 def add_chat_id():
     data = decrypt_json(request.json)
     username = data.get('username')
@@ -211,40 +326,55 @@ def add_chat_id():
     if not username or not chat_id:
         return jsonify({"error": "Username and chat_id are required"}), 400
 
+    limited = check_user_rate(username)
+    if limited:
+        return limited
+
     success, message = UserDatabase.add_chat_id(username, chat_id)
     if success:
         return jsonify({"message": message}), 200
     else:
         return jsonify({"error": message}), 404
 
+# Source of the StockAnalyser results: a SnapshotClient reading from stockAnalyser.py by default,
+# replaced by a SnapshotStore when the analyser runs in this process (--with-analyser).
+config_reader = ConfigReader()
+pipeline_info = config_reader.get_pipeline_info()
+snapshot_source = SnapshotClient(pipeline_info["snapshot_host"], pipeline_info["snapshot_port"])
+# Snapshots older than this are not served, e.g. when every tick of the analyser is failing
+SNAPSHOT_MAX_AGE = pipeline_info["snapshot_max_age"]
+
+
+def send_snapshot_field(field, download_name, mimetype):
+    """
+    Send one field of the latest analysis snapshot as a file.
+    Responds with a 503 if no recent snapshot (or no data for that field) is available.
+    """
+    snapshot = snapshot_source.latest()
+    if snapshot is None or not getattr(snapshot, field):
+        return jsonify({"error": "Analysis not available yet"}), 503
+    if time.time() - snapshot.created > SNAPSHOT_MAX_AGE:
+        return jsonify({"error": "Analysis is out of date"}), 503
+    response = send_file(io.BytesIO(getattr(snapshot, field)), mimetype=mimetype,
+                         as_attachment=True, download_name=download_name)
+    response.headers['X-Snapshot-Version'] = str(snapshot.version)
+    return response
+
+
 @app.route('/get_fullness_txt', methods=['GET'])
 def get_fullness_txt():
-    file_path = './fullness.txt'  # Ensure this is the correct path to your file
-    try:
-        return send_file(file_path, as_attachment=True)
-    except FileNotFoundError:
-        return jsonify({"error": "File not found"}), 404
+    return send_snapshot_field('fullness_txt', 'fullness.txt', 'text/plain')
     
     
 @app.route('/get_analysis', methods=['GET'])
 def get_analysis():
-    file_path = os.path.join(os.getcwd(), 'analysis.txt')
-    print(file_path)
-    # file_path = './analysis.txt'  # Ensure this is the correct path to your file
-    try:
-        return send_file(file_path, as_attachment=True)
-    except FileNotFoundError:
-        return jsonify({"error": "File not found"}), 404
+    return send_snapshot_field('analysis_txt', 'analysis.txt', 'text/plain')
 
 
 # Route to get the PNG image (storagetank_fullness.png)
 @app.route('/get_fullness_image', methods=['GET'])
 def get_fullness_image():
-    file_path = './storagetank_fullness.png'  # Ensure this is the correct path to your PNG file
-    try:
-        return send_file(file_path, mimetype='image/png', as_attachment=True)
-    except FileNotFoundError:
-        return jsonify({"error": "File not found"}), 404
+    return send_snapshot_field('image_png', 'storagetank_fullness.png', 'image/png')
 
 @app.route('/test', methods=['GET'])
 def test_route():
@@ -253,6 +383,7 @@ def test_route():
 
 
 @app.route('/who_is_in', methods=['POST', 'GET'])
+@admission_control
 def who_is_in():
     occupants_file = 'occupants.json'
 
@@ -306,9 +437,27 @@ def get_all_chat_ids():
     return jsonify({'chat_ids': list(chat_ids)}), 200
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--with-analyser', action='store_true',
+                        help="Run the StockAnalyser pipeline in this process instead of reading it from stockAnalyser.py")
+    args = parser.parse_args()
+
     # Initialize an empty JSON file if it doesn't exist
     if not os.path.exists('users.json'):
         with open('users.json', 'w') as file:
             json.dump({}, file)
 
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    if args.with_analyser:
+        from stockAnalyser import StockAnalyser
+        from pipeline import AnalysisPipeline
+
+        snapshot_source = SnapshotStore()
+        AnalysisPipeline(StockAnalyser(config_reader), snapshot_source,
+                         interval=pipeline_info["interval"],
+                         fetch_timeout=pipeline_info["fetch_timeout"],
+                         update_timeout=pipeline_info["update_timeout"],
+                         plot_timeout=pipeline_info["plot_timeout"]).start()
+        # The reloader would run a second copy of the pipeline in its child process
+        app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False)
+    else:
+        app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,194 @@
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+
+class PipelineStage:
+    """
+    A pipeline stage backed by a single worker thread, so that consecutive runs of the same stage
+    never overlap while different stages (e.g. fetch of the next tick and plot of the last one) do.
+
+    Skip-if-late policy: if the previous run of the stage is still busy when the next tick wants it,
+    the stage is skipped for that tick instead of queueing up behind it.
+    """
+    def __init__(self, name: str, timeout: float):
+        """
+        Initializes a PipelineStage object.
+
+        Args:
+            name (str): The name of the stage, used in log messages and the worker thread name.
+            timeout (float): The time budget in seconds of a run of the stage. The stage does not interrupt
+                             a run that overruns it: the overrun is logged, and later ticks skip the stage
+                             while the run is still busy. Stage functions that do network I/O are given
+                             the budget so they can stop in time themselves.
+
+        Returns:
+            None
+        """
+        self.name = name
+        self.timeout = timeout
+        self.skipped = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"pipeline-{name}")
+        self._future = None
+        self._started = 0.0
+
+    def submit(self, tick, fn, *args):
+        """
+        Run `fn(*args)` on the stage worker unless the previous run is still busy.
+
+        Returns:
+            future (Future): The future of the run, or None if the stage was skipped for this tick.
+        """
+        if self._future is not None and not self._future.done():
+            self.skipped += 1
+            running_for = time.monotonic() - self._started
+            if running_for > self.timeout:
+                print(f"Stage {self.name} has been running for {running_for:.1f}s (timeout {self.timeout}s), "
+                      f"skipping it for tick {tick}")
+            else:
+                print(f"Stage {self.name} is still busy, skipping it for tick {tick}")
+            return None
+        started = self._started = time.monotonic()
+        self._future = self._executor.submit(fn, *args)
+        self._future.add_done_callback(lambda future: self._report(tick, started, future))
+        return self._future
+
+    def _report(self, tick, started, future):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            print(f"Stage {self.name} failed for tick {tick}: {error}")
+            return
+        elapsed = time.monotonic() - started
+        if elapsed > self.timeout:
+            print(f"Stage {self.name} took {elapsed:.1f}s for tick {tick}, longer than its {self.timeout}s timeout")
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class AnalysisPipeline:
+    """
+    Runs the StockAnalyser fetch -> analyse -> update -> plot cycle on a fixed cadence.
+
+    Tick n is scheduled at start + n * interval on the monotonic clock, so the period does not drift
+    with the time the work takes. Fetching is waited for (up to its timeout) because the analysis
+    depends on it; the ThingSpeak update and the plot run in the background and may overlap the next
+    tick. Ticks whose start time has passed by more than `late_tolerance` are skipped rather than run
+    back to back. Results are published to a SnapshotStore instead of analysis.txt/fullness.txt.
+    """
+    def __init__(self, analyser, store, interval: float = 15, fetch_timeout: float = 10,
+                 update_timeout: float = 10, plot_timeout: float = 10, late_tolerance: float = None):
+        """
+        Initializes an AnalysisPipeline object.
+
+        Args:
+            analyser (StockAnalyser): The analyser whose stages are run.
+            store (SnapshotStore): The store the results are published to.
+            interval (float, optional): The period between ticks in seconds. Defaults to 15.
+            fetch_timeout (float, optional): Timeout of the ThingSpeak fetch stage in seconds. Defaults to 10.
+            update_timeout (float, optional): Timeout of the ThingSpeak update stage in seconds. Defaults to 10.
+            plot_timeout (float, optional): Timeout of the plot stage in seconds. Defaults to 10.
+            late_tolerance (float, optional): How late a tick may start before it is skipped.
+                                              Defaults to a tenth of the interval.
+
+        Returns:
+            None
+        """
+        self.analyser = analyser
+        self.store = store
+        self.interval = interval
+        self.late_tolerance = interval / 10 if late_tolerance is None else late_tolerance
+        self.fetch_stage = PipelineStage("fetch", fetch_timeout)
+        self.update_stage = PipelineStage("update", update_timeout)
+        self.plot_stage = PipelineStage("plot", plot_timeout)
+        self.skipped_ticks = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Run the pipeline in a background daemon thread.
+        """
+        self._thread = threading.Thread(target=self.run, name="analysis-pipeline", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        """
+        Stop scheduling new ticks and shut the stage workers down.
+        """
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        for stage in (self.fetch_stage, self.update_stage, self.plot_stage):
+            stage.shutdown()
+
+    def run(self):
+        """
+        Run ticks on the fixed cadence until stop() is called.
+        """
+        start = time.monotonic()
+        tick = 0
+        while not self._stop.is_set():
+            try:
+                self.run_tick(tick)
+            except Exception as e:
+                # Only drop this tick, the scheduler must keep running
+                print(f"Pipeline tick {tick} failed: {e}")
+            tick = self._next_tick(start, tick)
+            self._stop.wait(max(0.0, start + tick * self.interval - time.monotonic()))
+
+    def _next_tick(self, start, tick):
+        """
+        Returns the next tick to run, skipping those whose start time has already passed
+        by more than the late tolerance.
+        """
+        next_tick = tick + 1
+        earliest = math.ceil((time.monotonic() - self.late_tolerance - start) / self.interval)
+        if earliest > next_tick:
+            skipped = earliest - next_tick
+            self.skipped_ticks += skipped
+            print(f"Pipeline is late, skipping {skipped} tick(s)")
+            next_tick = earliest
+        return next_tick
+
+    def run_tick(self, tick):
+        """
+        Run a single tick: fetch and analyse, publish the results, then hand the ThingSpeak
+        update and the plot to their background stages.
+        """
+        analyser = self.analyser
+        fetch = self.fetch_stage.submit(tick, analyser.getThingspeakData, self.fetch_stage.timeout)
+        if fetch is None:
+            return
+        try:
+            fetch.result(timeout=self.fetch_stage.timeout)
+        except FutureTimeoutError:
+            print(f"Stage fetch timed out after {self.fetch_stage.timeout}s, dropping tick {tick}")
+            return
+        except Exception:
+            return  # Already reported by the stage
+
+        analyser.analyseData()
+        # Take a copy so that the background stages are not affected by the next tick
+        fullness = list(analyser.storagetank_fullness)
+        tank_list = analyser.storagetank_list
+        for i in range(len(tank_list)):
+            print(f"Raw distance for {tank_list[i].get_tag()}: {analyser.raw_data_list[i]} cm")
+            print(f"Fullness for {tank_list[i].get_tag()}: {fullness[i]:.2f}%")
+
+        self.store.publish(
+            tick=tick,
+            fullness=tuple((tank_list[i].get_tag(), fullness[i]) for i in range(len(tank_list))),
+            analysis_txt=analyser.buildAnalysisText(fullness).encode(),
+            fullness_txt=analyser.buildFullnessText(fullness).encode(),
+        )
+        self.update_stage.submit(tick, analyser.pushThingspeak, fullness, self.update_stage.timeout)
+        self.plot_stage.submit(tick, self._plot, tick, fullness)
+
+    def _plot(self, tick, fullness):
+        image_png = self.analyser.renderFullness(fullness)
+        self.store.publish(image_tick=tick, image_png=image_png)
@@ -0,0 +1,104 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable
+
+
+class TokenBucket:
+    """
+    A single token bucket that refills continuously up to a fixed capacity.
+    """
+    def __init__(self, capacity: float, refill_rate: float, now: float):
+        """
+        Initializes a full bucket.
+
+        Args:
+            capacity (float): The maximum number of tokens the bucket can hold (burst size).
+            refill_rate (float): The number of tokens added back per second.
+            now (float): The current monotonic time.
+
+        Returns:
+            None
+        """
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.tokens = capacity
+        self.last_refill = now
+
+    def consume(self, now: float, cost: float = 1.0):
+        """
+        Refill the bucket for the elapsed time and try to take `cost` tokens out of it.
+
+        Args:
+            now (float): The current monotonic time.
+            cost (float, optional): The number of tokens the request costs. Defaults to 1.
+
+        Returns:
+            retry_after (float): 0 if the tokens were taken, otherwise the number of seconds
+                                 until enough tokens will be available.
+        """
+        elapsed = max(0.0, now - self.last_refill)
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_rate)
+        self.last_refill = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.refill_rate
+
+
+class RateLimiter:
+    """
+    Keyed token-bucket rate limiter (e.g. per client IP or per (username, client IP) pair).
+
+    Buckets are kept in a bounded LRU map so that a flood of distinct keys can not grow memory
+    without limit: when the map is full, the least recently used bucket is dropped. A dropped key
+    simply starts again with a full bucket.
+    """
+    def __init__(self, capacity: float, refill_rate: float, max_entries: int = 10000):
+        """
+        Initializes a RateLimiter object.
+
+        Args:
+            capacity (float): The burst size allowed for each key.
+            refill_rate (float): The sustained number of requests per second allowed for each key.
+            max_entries (int, optional): The maximum number of keys tracked at once. Defaults to 10000.
+
+        Returns:
+            None
+        """
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.max_entries = max_entries
+        self._buckets: OrderedDict[Hashable, TokenBucket] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key: Hashable, cost: float = 1.0):
+        """
+        Charge a request to the bucket of `key`.
+
+        Args:
+            key (Hashable): The client identifier, e.g. the remote IP address or a (username, IP) pair.
+            cost (float, optional): The number of tokens the request costs. Defaults to 1.
+
+        Returns:
+            (allowed, retry_after) (tuple[bool, int]): Whether the request is within budget, and if not,
+                                                       the whole number of seconds the client should wait.
+        """
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.capacity, self.refill_rate, now)
+                self._buckets[key] = bucket
+                if len(self._buckets) > self.max_entries:
+                    self._buckets.popitem(last=False)   # Evict the least recently used key
+            else:
+                self._buckets.move_to_end(key)
+            retry_after = bucket.consume(now, cost)
+        if retry_after > 0:
+            return False, max(1, math.ceil(retry_after))
+        return True, 0
+
+    def __len__(self):
+        return len(self._buckets)
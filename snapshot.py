@@ -0,0 +1,203 @@
+import json
+import secrets
+import socket
+import socketserver
+import struct
+import threading
+import time
+from dataclasses import dataclass, field, replace
+
+# Wire format of the snapshot socket:
+#   client -> server: the epoch and version the client already holds (two unsigned 64-bit, 0 if none)
+#   server -> client: length of the JSON header (unsigned 32-bit, 0 if the client is up to date),
+#                     the JSON header, then the analysis, fullness and image blobs back to back.
+_VERSION = struct.Struct("!QQ")
+_HEADER_LEN = struct.Struct("!I")
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """
+    An immutable, versioned view of the latest analysis results.
+    Readers keep a reference to it, so it is never modified once published.
+    """
+    epoch: int = 0                          # Random id of the publishing process, versions restart with it
+    version: int = 0
+    tick: int = -1                          # The pipeline tick the analysis results belong to
+    created: float = 0.0                    # Wall clock time of publication
+    fullness: tuple = ()                    # ((tag, fullness %), ...) for each storage tank
+    analysis_txt: bytes = b""               # Content previously written to analysis.txt
+    fullness_txt: bytes = b""               # Content previously written to fullness.txt
+    image_tick: int = -1                    # The pipeline tick the image was rendered for
+    image_png: bytes = field(default=b"", repr=False)
+
+
+class SnapshotStore:
+    """
+    In-process holder of the latest Snapshot. Publishing swaps a single reference,
+    so readers (e.g. Flask request threads) never see a half-written result and never copy it.
+    """
+    def __init__(self):
+        self._snapshot = Snapshot(epoch=secrets.randbits(63) + 1)
+        self._lock = threading.Lock()
+
+    def publish(self, **changes):
+        """
+        Publish a new version, taking any field not given in `changes` from the current snapshot.
+
+        Returns:
+            snapshot (Snapshot): The newly published snapshot.
+        """
+        with self._lock:
+            self._snapshot = replace(self._snapshot, version=self._snapshot.version + 1,
+                                     created=time.time(), **changes)
+            return self._snapshot
+
+    def latest(self):
+        """
+        Returns the latest published Snapshot, or None if nothing has been published yet.
+        """
+        snapshot = self._snapshot
+        return snapshot if snapshot.version else None
+
+
+def _encode(snapshot: Snapshot):
+    header = {
+        "epoch": snapshot.epoch,
+        "version": snapshot.version,
+        "tick": snapshot.tick,
+        "created": snapshot.created,
+        "fullness": [list(item) for item in snapshot.fullness],
+        "image_tick": snapshot.image_tick,
+        "sizes": [len(snapshot.analysis_txt), len(snapshot.fullness_txt), len(snapshot.image_png)],
+    }
+    header_bytes = json.dumps(header).encode()
+    return _HEADER_LEN.pack(len(header_bytes)) + header_bytes
+
+
+def _recv_exact(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            raise ConnectionError("Snapshot socket closed mid-message")
+        received += n
+    return buffer
+
+
+def _read_exact(stream, size):
+    # A buffered read of a large size is received straight into the returned bytes object,
+    # so each blob is copied out of the socket once and is immutable, as send_file requires.
+    data = stream.read(size)
+    if len(data) != size:
+        raise ConnectionError("Snapshot socket closed mid-message")
+    return data
+
+
+class SnapshotServer(socketserver.ThreadingTCPServer):
+    """
+    Serves the snapshots of a SnapshotStore to other local processes (e.g. database_server.py
+    when it is run separately from stockAnalyser.py).
+    Each version is encoded once; the blobs are sent straight from the published snapshot.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, store: SnapshotStore, host: str = "127.0.0.1", port: int = 5001):
+        """
+        Initializes a SnapshotServer object and binds it to `host`:`port`.
+
+        Args:
+            store (SnapshotStore): The store whose snapshots are served.
+            host (str, optional): The address to listen on. Defaults to localhost only.
+            port (int, optional): The port to listen on. Defaults to 5001.
+
+        Returns:
+            None
+        """
+        self.store = store
+        self._encoded = ((0, 0), b"")
+        self._encode_lock = threading.Lock()
+        super().__init__((host, port), _SnapshotRequestHandler)
+
+    def encoded_header(self, snapshot: Snapshot):
+        with self._encode_lock:
+            key = (snapshot.epoch, snapshot.version)
+            if self._encoded[0] != key:
+                self._encoded = (key, _encode(snapshot))
+            return self._encoded[1]
+
+    def start(self):
+        """
+        Serve in a background daemon thread.
+        """
+        thread = threading.Thread(target=self.serve_forever, name="snapshot-server", daemon=True)
+        thread.start()
+        return thread
+
+
+class _SnapshotRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        known = _VERSION.unpack(_recv_exact(self.request, _VERSION.size))
+        snapshot = self.server.store.latest()
+        if snapshot is None or (snapshot.epoch, snapshot.version) == known:
+            self.request.sendall(_HEADER_LEN.pack(0))
+            return
+        self.request.sendall(self.server.encoded_header(snapshot))
+        for blob in (snapshot.analysis_txt, snapshot.fullness_txt, snapshot.image_png):
+            if blob:
+                self.request.sendall(memoryview(blob))
+
+
+class SnapshotClient:
+    """
+    Reads snapshots from a SnapshotServer. Only snapshots that differ from the cached one are transferred.
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 5001, timeout: float = 1.0):
+        """
+        Initializes a SnapshotClient object.
+
+        Args:
+            host (str, optional): The address of the SnapshotServer. Defaults to localhost.
+            port (int, optional): The port of the SnapshotServer. Defaults to 5001.
+            timeout (float, optional): Socket timeout in seconds. Defaults to 1.
+
+        Returns:
+            None
+        """
+        self.address = (host, port)
+        self.timeout = timeout
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def latest(self):
+        """
+        Returns the latest Snapshot from the server. If the server can not be reached,
+        the last snapshot received is returned (None if there never was one).
+        """
+        with self._lock:
+            known = (self._snapshot.epoch, self._snapshot.version) if self._snapshot else (0, 0)
+            try:
+                with socket.create_connection(self.address, timeout=self.timeout) as sock, \
+                        sock.makefile('rb') as stream:
+                    sock.sendall(_VERSION.pack(*known))
+                    (header_len,) = _HEADER_LEN.unpack(_read_exact(stream, _HEADER_LEN.size))
+                    if header_len:
+                        header = json.loads(_read_exact(stream, header_len))
+                        blobs = [_read_exact(stream, size) for size in header["sizes"]]
+                        self._snapshot = Snapshot(
+                            epoch=header["epoch"],
+                            version=header["version"],
+                            tick=header["tick"],
+                            created=header["created"],
+                            fullness=tuple(tuple(item) for item in header["fullness"]),
+                            analysis_txt=blobs[0],
+                            fullness_txt=blobs[1],
+                            image_tick=header["image_tick"],
+                            image_png=blobs[2],
+                        )
+            except (OSError, ValueError) as e:
+                print(f"Snapshot server unavailable: {e}")
+            return self._snapshot
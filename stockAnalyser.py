@@ -1,7 +1,8 @@
-import requests
+import io
 import time
-import matplotlib.pyplot as plt
+import requests
 import matplotlib.patches as mpatches
+from matplotlib.figure import Figure
 try:
     from config_reader import ConfigReader
 except:
@@ -10,6 +11,8 @@ except:
     # Add the parent directory to the system path
     sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
     from config_reader import ConfigReader
+from pipeline import AnalysisPipeline
+from snapshot import SnapshotStore, SnapshotServer
 
 
 class StorageTank:
@@ -141,7 +144,7 @@ class StockAnalyser:
         self.raw_data_list: list[float] = [0]*self.storagetank_num        
         self.storagetank_fullness = [0]*self.storagetank_num    # A list to store the fullness of each dustbin
             
-    def getThingspeakData(self):
+    def getThingspeakData(self, timeout=None):
         """
         Retrieves data from the Thingspeak API for each storge tank in the storagetank_list.
 
@@ -151,14 +154,24 @@ class StockAnalyser:
         to the raw_data_dict for the corresponding tank dustbin for further analysis.
 
         Args:
-            None
+            timeout (float, optional): Time budget in seconds for all the requests to ThingSpeak together.
+                                       Each request is given the time left of it. Defaults to None (no timeout).
             
         Returns:
             None
+
+        Raises:
+            TimeoutError: If the time budget runs out before every tank has been retrieved.
         """
+        deadline = None if timeout is None else time.monotonic() + timeout
         for i in range(self.storagetank_num):
             print(f"Retrieving data for plot {i+1}...")
-            response = requests.get(self.storagetank_list[i].get_url())
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"Ran out of time after retrieving {i} of {self.storagetank_num} tanks")
+            response = requests.get(self.storagetank_list[i].get_url(), timeout=remaining)
             if response.status_code == 200:
                 # print(f"Data for plot {i+1} retrieved successfully, status code: {response.status_code}")
                 json_data = response.json()
@@ -198,100 +211,118 @@ class StockAnalyser:
             self.storagetank_fullness[i] = fullness
         
     
-    def updateThingspeak(self):
+    def pushThingspeak(self, fullness=None, timeout=None):
         """
-        Updates the Thingspeak channel with the latest tank fullness data
-        and creates a text file named "analysis.txt" that writes the fullness information for each tank
-        The file includes the fullness percentage for each storage tank, 
-        as well as the storage tank with the highest and lowest fullness.
+        Updates the Thingspeak channel with the tank fullness data.
 
         Args:
-            None
+            fullness (list[float], optional): The fullness of each tank. Defaults to the latest analysed fullness.
+            timeout (float, optional): Timeout in seconds for the request to ThingSpeak. Defaults to None (no timeout).
 
         Returns:
             None
         """
+        if fullness is None:
+            fullness = self.storagetank_fullness
         RequestToThingspeak = f"https://api.thingspeak.com/update?api_key={self.write_api_key}" 
         # add the data for each dustbin to the request for simultaneous update of all dustbins
         for i in range(self.storagetank_num):
-            RequestToThingspeak += f"&field{i+1}={self.storagetank_fullness[i]}"    
+            RequestToThingspeak += f"&field{i+1}={fullness[i]}"    
         
         ### for testing purposes
-        request = requests.get(RequestToThingspeak)
+        request = requests.get(RequestToThingspeak, timeout=timeout)
         print(request.text)
-        
-        # create a txt file for telegram sending
-        # construct data for writing to the txt file
+
+    def buildAnalysisText(self, fullness=None):
+        """
+        Builds the analysis message for telegram sending, which includes the fullness percentage for each
+        storage tank, as well as the storage tank with the highest and lowest fullness.
+
+        Args:
+            fullness (list[float], optional): The fullness of each tank. Defaults to the latest analysed fullness.
+
+        Returns:
+            text (str): The content of "analysis.txt"
+        """
+        if fullness is None:
+            fullness = self.storagetank_fullness
         data = []
         data.append(f"Fullness for Each Storage Tank")
         for i in range(self.storagetank_num):
-            data.append(f"Storage Tank {self.storagetank_list[i].get_tag()}: {self.storagetank_fullness[i]:.2f}%")
-        max_index = self.storagetank_fullness.index(max(self.storagetank_fullness))
-        min_index = self.storagetank_fullness.index(min(self.storagetank_fullness))
+            data.append(f"Storage Tank {self.storagetank_list[i].get_tag()}: {fullness[i]:.2f}%")
+        max_index = fullness.index(max(fullness))
+        min_index = fullness.index(min(fullness))
         data.append(f"Note:")
-        data.append(f"Highest stock level in Storage Tank {self.storagetank_list[max_index].get_tag()} - {max(self.storagetank_fullness):.2f}%. Check for potential expiration.")
-        data.append(f"Stock replenishment needed for Storage Tank {self.storagetank_list[min_index].get_tag()} - {min(self.storagetank_fullness):.2f}% remaining.")
-
-        # write the data to the txt file
-        file_path = "analysis.txt"
-        data_with_newlines = [line + "\n" for line in data]
-        with open(file_path, 'w') as file:
-            file.writelines(data_with_newlines)
-            
-        # store all the current fullness to txt file as well
-        with open('fullness.txt', 'w') as file:
-            for i in range(self.storagetank_num):
-                line = f"{self.storagetank_list[i].get_tag()} {self.storagetank_fullness[i]}"
-                file.write(line + "\n")
-                
-    
-    def plotFullness(self):
+        data.append(f"Highest stock level in Storage Tank {self.storagetank_list[max_index].get_tag()} - {max(fullness):.2f}%. Check for potential expiration.")
+        data.append(f"Stock replenishment needed for Storage Tank {self.storagetank_list[min_index].get_tag()} - {min(fullness):.2f}% remaining.")
+        return "".join(line + "\n" for line in data)
+
+    def buildFullnessText(self, fullness=None):
+        """
+        Builds a listing of the current fullness of each storage tank, one "<tag> <fullness>" per line.
+
+        Args:
+            fullness (list[float], optional): The fullness of each tank. Defaults to the latest analysed fullness.
+
+        Returns:
+            text (str): The content of "fullness.txt"
+        """
+        if fullness is None:
+            fullness = self.storagetank_fullness
+        return "".join(f"{self.storagetank_list[i].get_tag()} {fullness[i]}\n" for i in range(self.storagetank_num))
+
+    def renderFullness(self, fullness=None):
         """
-        Plots the fullness of each tank in a bar chart.
+        Renders the fullness of each tank in a bar chart.
 
         This function generates a bar chart to visualize the current fullness of each storage tank.
         The bar colors are set based on the tank types (Grains, Sugar, Flour, Legumes).
+        It draws on its own Figure rather than the global pyplot figure, so it is safe to call
+        from a worker thread.
 
         Args:
-            None
+            fullness (list[float], optional): The fullness of each tank. Defaults to the latest analysed fullness.
 
         Returns:
-            None
+            image (bytes): The chart as a PNG image
         """
+        if fullness is None:
+            fullness = self.storagetank_fullness
         tank_tags = [f"{self.storagetank_list[i].get_tag()}" for i in range(self.storagetank_num)]
         # Set specific bar colors for each tank
         bar_colors = ['blue', 'red', 'green', 'purple']  # Order corresponds to Grains, Sugar, Flour, Legumes
-        plt.clf()                                       # Clear the current figure to update with new data
-        plt.bar(tank_tags, self.storagetank_fullness, color=bar_colors)
-        plt.xlabel('Storage Tank')
-        plt.ylabel('Current Fullness (%)')
-        plt.title('Fullness for Each Tank')
-        plt.ylim(0, 100)                                # Set the y-axis limit to 100%
+        figure = Figure()
+        ax = figure.subplots()
+        ax.bar(tank_tags, fullness, color=bar_colors)
+        ax.set_xlabel('Storage Tank')
+        ax.set_ylabel('Current Fullness (%)')
+        ax.set_title('Fullness for Each Tank')
+        ax.set_ylim(0, 100)                             # Set the y-axis limit to 100%
         # Add grid for better visibility
-        plt.grid(True, which='both', linestyle='--', linewidth=0.5)
-        # Save the figure without the legend
-        plt.savefig("storagetank_fullness.png")
-        # Save the plot to a png file    
+        ax.grid(True, which='both', linestyle='--', linewidth=0.5)
+        buffer = io.BytesIO()
+        figure.savefig(buffer, format="png")
+        return buffer.getvalue()
     
 
 if __name__ == "__main__":
     # Read info using config_reader
     config_reader = ConfigReader()
     data_analyser = StockAnalyser(config_reader)
-    
+    pipeline_info = config_reader.get_pipeline_info()
+
+    # Publish the results to database_server.py over a local socket
+    store = SnapshotStore()
+    snapshot_server = SnapshotServer(store, pipeline_info["snapshot_host"], pipeline_info["snapshot_port"])
+    snapshot_server.start()
+    pipeline = AnalysisPipeline(data_analyser, store,
+                                interval=pipeline_info["interval"],
+                                fetch_timeout=pipeline_info["fetch_timeout"],
+                                update_timeout=pipeline_info["update_timeout"],
+                                plot_timeout=pipeline_info["plot_timeout"])
     try:
-        while True:
-            data_analyser.getThingspeakData()  # Fetch the latest data
-            data_analyser.analyseData()        # Analyse the fetched data
-            tank_list = data_analyser.storagetank_list
-            for i in range(len(tank_list)):
-                # Print the latest distance data for each dustbin
-                print(f"Raw distance for {tank_list[i].get_tag()}: {data_analyser.raw_data_list[i]} cm")
-                print(f"Fullness for {tank_list[i].get_tag()}: {data_analyser.storagetank_fullness[i]:.2f}%")
-            data_analyser.updateThingspeak()   # Update Thingspeak with the analysed data
-            data_analyser.plotFullness()       # Plot the latest data
-            time.sleep(15)                     # Wait for 15 seconds before the next update
+        pipeline.run()                         # Fetch, analyse, update and plot every interval
     except KeyboardInterrupt:
+        pipeline.stop()
+        snapshot_server.shutdown()
         exit()
-
-